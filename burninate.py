@@ -2,37 +2,181 @@
 
 import asyncio
 import atexit
-from time import sleep
+import functools
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
 
 from websockets.server import serve
 import websockets
-from gpiozero import Button, LED, DigitalOutputDevice, CPUTemperature
+
+import patterns
+
+try:
+    from gpiozero import Button, LED, DigitalOutputDevice, CPUTemperature
+except ImportError:
+    Button = LED = DigitalOutputDevice = CPUTemperature = None
+
+try:
+    import lgpio
+except ImportError:
+    lgpio = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+if orjson is not None:
+    # C serializer, ~5x json.dumps on these small dicts, and it
+    # returns bytes that websockets frames directly with no re-encode.
+    json_dumps = orjson.dumps
+else:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
 
 
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
 logger = logging.getLogger('websockets')
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Our own logs go through a queue: the ignition paths pay a lock-free
+# enqueue instead of a write() syscall between dispatch and valve-on,
+# and a background thread does the actual I/O.
+log = logging.getLogger('burninate')
+log.setLevel(logging.INFO)
+_log_queue = queue.SimpleQueue()
+log.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+
+
+# BCM pin per valve; 1-indexed to match the pyro-relay board.
+VALVE_PINS = {
+    1: 17,  # outside right (from the fire station)
+    2: 22,  # middle right
+    3: 27,  # inside right
+    4: 4,   # inside left
+    5: 23,  # middle left
+    6: 24,  # outside left
+    7: 25,  # Tail
+    8: 9,   # extra
+}
+
+ALL_MASK = (1 << len(VALVE_PINS)) - 1
+
+def flames_to_mask(flames):
+    mask = 0
+    for flame in flames:
+        mask |= 1 << (flame - 1)
+    return mask
+
+# Which valves are currently commanded on, as one int. Updated on
+# every write (from the event loop or the edge thread, hence the lock)
+# so "what's burning right now" is a single load instead of N device
+# reads.
+current_mask = 0
+# monotonic_ns of the last GPIO write, for the safety monitor
+last_write_ns = 0
+_state_lock = threading.Lock()
+
+if lgpio is not None:
+    # One masked group write covers every valve in one syscall, instead
+    # of a gpiozero property/pin-factory round trip per pin. The cheap
+    # relay board is active-low, so claim everything high (= off) and
+    # invert at the write site.
+    _chip = lgpio.gpiochip_open(0)
+    _group = list(VALVE_PINS.values())
+    lgpio.group_claim_output(_chip, _group, [1] * len(_group))
+
+    def write_mask(mask, on):
+        global current_mask, last_write_ns
+        with _state_lock:
+            if on:
+                current_mask |= mask
+            else:
+                current_mask &= ~mask
+            last_write_ns = time.monotonic_ns()
+            lgpio.group_write(_chip, _group[0], 0 if on else mask, mask)
+else:
+    class MockGPIO:
+        # Last-resort dev backend (laptop testing, no GPIO stack at
+        # all): just tracks commanded levels so the rest of the server
+        # behaves normally.
+        def __init__(self, pins):
+            self._pins = dict.fromkeys(pins, False)
+            # Live read-only view -- pollers get current state with no
+            # dict copy per call.
+            self.pin_states = MappingProxyType(self._pins)
+            self._bits = [(1 << (flame - 1), pin)
+                          for flame, pin in VALVE_PINS.items()]
+
+        def write_mask(self, mask, on):
+            global current_mask, last_write_ns
+            with _state_lock:
+                if on:
+                    current_mask |= mask
+                else:
+                    current_mask &= ~mask
+                last_write_ns = time.monotonic_ns()
+                for bit, pin in self._bits:
+                    if mask & bit:
+                        self._pins[pin] = on
 
-
-# Create our own Poofer class, reversing high/low because cheap relay board
-class Poofer(DigitalOutputDevice):
-    def __init__(self, pin):
-        DigitalOutputDevice.__init__(self, pin, active_high=False, initial_value=False)
-
-# Poofers
-valves = [
-    None,  # using 1-indexing to match pyro-relay board.
-    Poofer(17),  # outside right (from the fire station)
-    Poofer(22),  # middle right
-    Poofer(27),  # inside right
-    Poofer(4),   # inside left
-    Poofer(23),  # middle left
-    Poofer(24),  # outside left
-    Poofer(25),  # Tail
-    Poofer(9),   # extra
-]
+    try:
+        # Fall back to per-pin gpiozero writes, still reversing
+        # high/low for the relay board.
+        class Poofer(DigitalOutputDevice):
+            def __init__(self, pin):
+                DigitalOutputDevice.__init__(self, pin, active_high=False, initial_value=False)
+
+        _poofers = {flame: Poofer(pin) for flame, pin in VALVE_PINS.items()}
+        # Pre-bind each valve's bit and on/off methods so the write path
+        # doesn't redo dict iteration and attribute lookups per edge.
+        _poofer_bits = [
+            (1 << (flame - 1), poofer.on, poofer.off)
+            for flame, poofer in _poofers.items()
+        ]
+
+        def write_mask(mask, on):
+            global current_mask, last_write_ns
+            with _state_lock:
+                if on:
+                    current_mask |= mask
+                else:
+                    current_mask &= ~mask
+                last_write_ns = time.monotonic_ns()
+                for bit, on_fn, off_fn in _poofer_bits:
+                    if mask & bit:
+                        if on:
+                            on_fn()
+                        else:
+                            off_fn()
+    except Exception:
+        # No lgpio and no usable gpiozero pin factory
+        mock_gpio = MockGPIO(VALVE_PINS.values())
+        write_mask = mock_gpio.write_mask
+        logging.warning("no GPIO backend available, valve writes are mocked")
 
 # viewed from the fire pedestal
 stalks = {
@@ -43,189 +187,536 @@ stalks = {
     'left-middle': 5,
     'left-outside': 6,
     'tail': 7
-} 
+}
+
+class EdgeScheduler(threading.Thread):
+    # Fires valve edges at absolute time.monotonic_ns() deadlines from a
+    # dedicated thread. asyncio wakeups on the Pi are only good for
+    # ~1-10ms, which is visible jitter in a flame burst; here we sleep
+    # out the bulk of each wait on the condition variable and busy-wait
+    # the last ~0.5ms so edges land within well under a millisecond.
+
+    BUSY_WAIT_NS = 500_000
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True, name='edge-scheduler')
+        self._heap = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()  # tie-break equal deadlines
+
+    def schedule(self, deadline_ns, mask, on):
+        # Returns an entry token usable with cancel().
+        return self._push(deadline_ns, (mask, on))
+
+    def schedule_call(self, deadline_ns, fn):
+        # Same heap, arbitrary callable -- used for watchdog expiries so
+        # every timed action lives on this one scheduler and fires even
+        # if the asyncio loop is wedged.
+        return self._push(deadline_ns, fn)
+
+    def _push(self, deadline_ns, action):
+        entry = [deadline_ns, next(self._seq), action, False]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return entry
+
+    @staticmethod
+    def cancel(entry):
+        entry[3] = True
+
+    def clear(self):
+        with self._cond:
+            del self._heap[:]
+
+    def run(self):
+        try:
+            # Best effort; needs CAP_SYS_NICE, and keeps edge timing
+            # steady when the websocket side is busy.
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except (AttributeError, PermissionError, OSError):
+            pass
+        monotonic_ns = time.monotonic_ns
+        heap = self._heap
+        cond = self._cond
+        while True:
+            with cond:
+                while not heap:
+                    cond.wait()
+                deadline = heap[0][0]
+                now = monotonic_ns()
+                if deadline - now > self.BUSY_WAIT_NS:
+                    cond.wait((deadline - now - self.BUSY_WAIT_NS) / 1e9)
+                    continue
+                entry = heapq.heappop(heap)
+            if entry[3]:
+                continue
+            deadline, _, action, _ = entry
+            while monotonic_ns() < deadline:
+                pass
+            # Re-check the flag after the busy-wait: a finally-block
+            # cancelling its edges can land inside that window, and a
+            # stale on-edge fired after its off-write would stick the
+            # valve on.
+            if entry[3]:
+                continue
+            if callable(action):
+                action()
+            else:
+                mask, on = action
+                if on and emergency_stop:
+                    # estop flipped after this edge was queued
+                    continue
+                write_mask(mask, on)
+
+edges = EdgeScheduler()
+edges.start()
 
 def allFireOff():
-    global valves
-    for valve in valves:
-        if not valve:
-            continue
-        valve.off()
+    edges.clear()
+    write_mask(ALL_MASK, False)
 
 atexit.register(allFireOff)
 
-async def ignition_timer(websocket, flames, duration, repetitions=1, rep_delay=None, start_delay=0):
-    print("ingition_timer_1")
-    await asyncio.sleep(start_delay)
-    for rep in range(0,repetitions):
-        for flame in flames:
-            valves[flame].on()
-
-        await asyncio.sleep(duration)
+# Longest a stalk may burn continuously. The hold-open endpoints (a
+# stalk or 'all' stays lit while the websocket is connected) otherwise
+# leave fire on until TCP gives up on a wedged client.
+MAX_FIRE_DURATION = 10
+MAX_FIRE_NS = MAX_FIRE_DURATION * 1_000_000_000
+
+_watchdogs = {}
+
+def _watchdog_expire(mask):
+    _watchdogs.pop(mask, None)
+    log.warning("watchdog: forcing mask %#x off after %ss", mask, MAX_FIRE_DURATION)
+    write_mask(mask, False)
+
+# Emergency stop. A plain bool: single-word loads are atomic under the
+# GIL, so every fire path can re-check it for free right before
+# touching a valve, and flipping it bounds estop latency by one check
+# rather than whatever is queued.
+emergency_stop = False
+
+def estop():
+    global emergency_stop
+    emergency_stop = True
+    pattern_engine.stop()
+    allFireOff()
+
+def clear_estop():
+    global emergency_stop
+    emergency_stop = False
+    log.warning("emergency stop cleared")
+
+def fire_on(mask):
+    # Turn the valves on and arm a forced-off on the edge scheduler's
+    # heap -- one timer mechanism for everything, and the forced-off
+    # still lands if the asyncio loop stalls. Re-firing the same mask
+    # just re-arms its watchdog.
+    if emergency_stop:
+        return
+    old = _watchdogs.pop(mask, None)
+    if old is not None:
+        edges.cancel(old)
+    write_mask(mask, True)
+    _watchdogs[mask] = edges.schedule_call(
+        time.monotonic_ns() + MAX_FIRE_NS,
+        functools.partial(_watchdog_expire, mask))
+
+def fire_off(mask):
+    entry = _watchdogs.pop(mask, None)
+    if entry is not None:
+        edges.cancel(entry)
+    write_mask(mask, False)
+
+class FireGuard:
+    # Holds a mask lit for the lifetime of a with-block and guarantees
+    # the off-write on the way out, however the block exits. The off
+    # callable is captured up front so the recovery path does no
+    # attribute or global lookups that could themselves raise.
+    def __init__(self, mask):
+        self.mask = mask
+        self._off = functools.partial(fire_off, mask)
+
+    def __enter__(self):
+        fire_on(self.mask)
+        return self
+
+    def __exit__(self, *exc):
+        self._off()
+        return False
+
+def scheduled_burst(at_ns, mask, duration_ns):
+    if emergency_stop:
+        return
+    edges.schedule(at_ns, mask, True)
+    edges.schedule(at_ns + duration_ns, mask, False)
+
+pattern_engine = patterns.PatternEngine(
+    scheduled_burst, lambda mask: write_mask(mask, False))
+
+# Beat-synced sweep across the stalks and back, the sequence2 shape on
+# a tick grid.
+SWEEP = patterns.Pattern(name='sweep', bpm=120, tick_resolution=4)
+for _i, _flame in enumerate([1, 2, 3, 4, 5, 6, 5, 4, 3, 2]):
+    SWEEP.add_event(patterns.FireEvent(_flame, _i, .1))
+
+# (flames, duration, repetitions[, period, start_delay]) per timer,
+# frozen at module load; the handlers just unpack them instead of
+# rebuilding the literal lists on every loop pass.
+SEQ1_SPEC = (
+    ((1, 3, 5), .375, 3),
+    ((2, 4, 6), .250, 5),
+)
+SEQ3_SPEC = (
+    ((1, 6), .2, 1, .4, 0),
+    ((2, 5), .2, 1, .4, .5),
+    ((3, 4), .2, 1, .4, 1),
+    ((7,), .2, 1, .4, 1.5),
+)
+
+# Pattern specs: (flames, duration, repetitions, rep_delay, start_delay)
+SEQ2_SPEC = [
+    ([1], .2, 1, 2, 0),
+    ([2], .2, 1, 2, .2),
+    ([3], .2, 1, 2, .4),
+    ([4], .2, 1, 2, .6),
+    ([5], .2, 1, 2, .8),
+    ([6], .2, 1, 2, 1),
+    ([5], .2, 1, 2, 1.2),
+    ([4], .2, 1, 2, 1.4),
+    ([3], .2, 1, 2, 1.6),
+    ([2], .2, 1, 2, 1.8),
+]
 
-        for flame in flames:
-            valves[flame].off()
+def build_schedule(specs):
+    # Flatten pattern specs into a single sorted tuple of
+    # (offset_ns, valve_mask, on) edges plus the cycle length and the
+    # union mask of every valve the schedule touches. Everything is
+    # precomputed in integer nanoseconds here, once at import, so the
+    # per-cycle work is just adding a base timestamp to each offset.
+    events = []
+    cycle_ns = 0
+    involved = 0
+    for flames, duration, repetitions, rep_delay, start_delay in specs:
+        mask = flames_to_mask(flames)
+        involved |= mask
+        period_ns = int((duration + (rep_delay or duration)) * 1e9)
+        duration_ns = int(duration * 1e9)
+        start_ns = int(start_delay * 1e9)
+        for rep in range(repetitions):
+            t_on = start_ns + rep * period_ns
+            events.append((t_on, mask, True))
+            events.append((t_on + duration_ns, mask, False))
+        cycle_ns = max(cycle_ns, start_ns + (repetitions - 1) * period_ns + duration_ns)
+    events.sort()
+    # Coalesce edges that land on the same deadline with the same
+    # polarity into one masked write: one heap entry and one syscall
+    # for a whole multi-flame hit instead of one per pattern.
+    merged = []
+    for offset_ns, mask, on in events:
+        if merged and merged[-1][0] == offset_ns and merged[-1][2] == on:
+            merged[-1] = (offset_ns, merged[-1][1] | mask, on)
+        else:
+            merged.append((offset_ns, mask, on))
+    return tuple(merged), cycle_ns, involved
+
+SEQ2_EVENTS, SEQ2_CYCLE_NS, SEQ2_MASK = build_schedule(SEQ2_SPEC)
+
+async def run_schedule(websocket, events, cycle_ns, involved):
+    # Hand every valve edge of one cycle to the edge thread at absolute
+    # deadlines, then sleep out the cycle in a single await. Much
+    # cheaper than spawning a Task per pattern every cycle, and the
+    # edges land with the thread's sub-ms accuracy instead of asyncio's.
+    _schedule = edges.schedule
+    while not websocket.close_rcvd:
+        t0 = time.monotonic_ns()
+        entries = [
+            _schedule(t0 + offset_ns, mask, on)
+            for offset_ns, mask, on in events
+        ]
+        try:
+            await sleep_until_ns(t0 + cycle_ns)
+        finally:
+            for entry in entries:
+                edges.cancel(entry)
+            write_mask(involved, False)
 
-        if repetitions > 1:
-            await asyncio.sleep(rep_delay or duration)
+async def sleep_until_ns(target_ns):
+    # Sleep to an absolute time.monotonic_ns() deadline so repeated
+    # sleeps don't accumulate wakeup lag -- bare asyncio.sleep(duration)
+    # drifts a little later every rep, which is visible across a
+    # multi-rep fire sequence.
+    await asyncio.sleep(max(0.0, (target_ns - time.monotonic_ns()) / 1e9))
 
-        if websocket.close_rcvd:
-            break
+async def ignition_timer(websocket, flames, duration, repetitions=1, rep_delay=None, start_delay=0):
+    log.debug("ignition_timer %s", flames)
+    # Hoist everything the rep loop touches out of the loop: the valve
+    # mask, the ns-converted intervals, and local refs for the globals
+    # we hit on every edge. The actual edges run on the edge thread;
+    # this coroutine just paces reps and watches for the client leaving.
+    mask = flames_to_mask(flames)
+    _schedule = edges.schedule
+    _sleep = sleep_until_ns
+    period_ns = int((duration + (rep_delay or duration)) * 1e9)
+    duration_ns = int(duration * 1e9)
+    base = time.monotonic_ns() + int(start_delay * 1e9)
+    entries = []
+    try:
+        for rep in range(0,repetitions):
+            t_on = base + rep * period_ns
+            entries.append(_schedule(t_on, mask, True))
+            entries.append(_schedule(t_on + duration_ns, mask, False))
+
+            if repetitions > 1:
+                await _sleep(base + (rep + 1) * period_ns)
+            else:
+                await _sleep(t_on + duration_ns)
+
+            if websocket.close_rcvd:
+                break
+    finally:
+        # Revoke any edge still queued on the edge thread -- if this
+        # coroutine is cancelled mid-sleep, a pending on-edge would
+        # otherwise fire after the off-write below.
+        for entry in entries:
+            edges.cancel(entry)
+        write_mask(mask, False)
 
 async def ignition_timer2(flames, duration, repetitions):
-    print("ingition_timer_2")
+    log.debug("ignition_timer2 %s", flames)
+    mask = flames_to_mask(flames)
+    duration_ns = int(duration * 1e9)
+    base = time.monotonic_ns()
     for rep in range(0,repetitions):
-        for flame in flames:
-            valves[flame].on()
-
-        await asyncio.sleep(duration)
+        t_on = base + rep * 2 * duration_ns
+        edges.schedule(t_on, mask, True)
+        edges.schedule(t_on + duration_ns, mask, False)
+        await sleep_until_ns(t_on + 2 * duration_ns)
 
-        for flame in flames:
-            valves[flame].off()
 
-        await asyncio.sleep(duration)
+# Outbound queue per subscribed WebSocket client
+cputemp_queues = {}
+status_queues = {}
 
+async def client_writer(websocket, out_q):
+    # One writer per subscriber: the broadcast tick just enqueues, so a
+    # slow client stalls (and eventually drops from) its own queue
+    # instead of holding up the producer or the other clients.
+    try:
+        while True:
+            message = await out_q.get()
+            await websocket.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        # Client went away mid-send; handle_subscriber unregisters us.
+        pass
 
 async def get_cpu_temp():
-    global connected_clients
+    if CPUTemperature is None:
+        log.warning("gpiozero unavailable, not reporting CPU temp")
+        return
     while True:
         cputemp = CPUTemperature().temperature
-        print(f"reporting CPU temp as {cputemp}")
+        log.info("reporting CPU temp as %s", cputemp)
         message = f"CPU Temperature: {cputemp:.1f} C"
-        # Send the message to all connected clients
-        for websocket in connected_clients:
+        for out_q in cputemp_queues.values():
             try:
-                await websocket.send(message)
-            except:
-                print(f"Failed updating CPU temp for client: {websocket}")
+                out_q.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow client; it misses this tick rather than
+                # backpressuring everyone else.
+                pass
 
         # Wait for 10 seconds before sending the next update
         await asyncio.sleep(10)
 
-def run_sequence(sequence):
-    pass
+# Encoded status frames, keyed by state. The whole state space is
+# (mask, estop) -- at most 2^8 * 2 frames -- so each distinct frame is
+# serialized exactly once for the life of the server and the steady
+# state (nothing burning, 10 ticks/s) is a dict hit.
+_status_frames = {}
+
+def status_frame(mask, stopped):
+    frame = _status_frames.get((mask, stopped))
+    if frame is None:
+        frame = _status_frames[(mask, stopped)] = json_dumps({
+            'mask': mask,
+            'flames': [f for f in VALVE_PINS if mask & (1 << (f - 1))],
+            'estop': stopped,
+        })
+    return frame
+
+async def status_broadcast():
+    # One producer for every /status subscriber: the payload is built
+    # once per tick, then fanned out through the per-client queues --
+    # N clients cost N enqueues, not N encodes.
+    while True:
+        await asyncio.sleep(0.1)
+        if not status_queues:
+            continue
+        message = status_frame(current_mask, emergency_stop)
+        for out_q in status_queues.values():
+            try:
+                out_q.put_nowait(message)
+            except asyncio.QueueFull:
+                pass
 
-async def handle_client(websocket):
-    global valves, stalks
-    logging.warning(websocket.path)
-    endpoint = websocket.path.split('/')[2]
-    if endpoint == 'cputemp':
-        print("adding client to cputemp list")
-        # Add the client's WebSocket connection to the list of connected clients
-        connected_clients.add(websocket)
-    if endpoint == 'sequence1':
-        while not websocket.close_rcvd:
-            coro = ignition_timer(websocket, [1,3,5],.375,3)
-            coro2 = ignition_timer(websocket, [2,4,6],.250,5)
-            task1 = asyncio.create_task(coro)
-            task2 = asyncio.create_task(coro2)
-            await task1
-            await task2
-
-
-    elif endpoint == 'sequence3':
-        while not websocket.close_rcvd:
-            pattern1 = ignition_timer(websocket, [1,6], .2, 1, .4, 0)
-            pattern2 = ignition_timer(websocket, [2,5], .2, 1, .4, .5)
-            pattern3 = ignition_timer(websocket, [3,4], .2, 1, .4, 1)
-            pattern4 = ignition_timer(websocket, [7,], .2, 1, .4, 1.5)
-
-            task1 = asyncio.create_task(pattern1)
-            task2 = asyncio.create_task(pattern2)
-            task3 = asyncio.create_task(pattern3)
-            task4 = asyncio.create_task(pattern4)
-            await task1
-            await task2
-            await task3
-            await task4
-
-    elif endpoint == 'sequence2':
-        while not websocket.close_rcvd:
-            tasks = {}
-            patterns = []
-            patterns.append(ignition_timer(websocket, [1,], .2, 1, 2, 0))
-            patterns.append(ignition_timer(websocket, [2,], .2, 1, 2, .2))
-            patterns.append(ignition_timer(websocket, [3,], .2, 1, 2, .4))
-            patterns.append(ignition_timer(websocket, [4,], .2, 1, 2, .6))
-            patterns.append(ignition_timer(websocket, [5,], .2, 1, 2, .8))
-            patterns.append(ignition_timer(websocket, [6,], .2, 1, 2, 1))
-            patterns.append(ignition_timer(websocket, [5,], .2, 1, 2, 1.2))
-            patterns.append(ignition_timer(websocket, [4,], .2, 1, 2, 1.4))
-            patterns.append(ignition_timer(websocket, [3,], .2, 1, 2, 1.6))
-            patterns.append(ignition_timer(websocket, [2,], .2, 1, 2, 1.8))
-            #patterns.append(ignition_timer(websocket, [2,], .2, 1, 2.2, 2))
-
-            for pattern in patterns:
-                tasks[patterns.index(pattern)] = asyncio.create_task(pattern)
-
-            for task in tasks:
-                await tasks[task]
-
-    elif endpoint == 'all':
-        try:
-            for flame in valves[1:]:
-                flame.on()
-            async for message in websocket:
-                await websocket.send(message)
-            logging.warning(f"stopping fire on all stalks!")
-            for flame in valves[1:]:
-                flame.off()
-        finally:
-            logging.warning(f"EMERGENCY stopping fire on all stalks!")
-            for flame in valves[1:]:
-                flame.off()
+async def handle_subscriber(websocket, queues):
+    # Shared register/unregister shell for broadcast endpoints
+    out_q = asyncio.Queue(maxsize=8)
+    queues[websocket] = out_q
+    writer = asyncio.create_task(client_writer(websocket, out_q))
+    try:
+        async for message in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        queues.pop(websocket, None)
+        writer.cancel()
 
+async def handle_status(websocket):
+    await handle_subscriber(websocket, status_queues)
 
-    elif endpoint in stalks.keys():
-        try:
-            logging.warning(f"firing stalk {endpoint}")
-            valves[stalks[endpoint]].on()
-            async for message in websocket:
-                await websocket.send(message)
-            valves[stalks[endpoint]].off()
-            logging.warning(f"stopping fire on stalk {endpoint}")
-        finally:
-            valves[stalks[endpoint]].off()
+async def handle_cputemp(websocket):
+    log.info("adding client to cputemp list")
+    await handle_subscriber(websocket, cputemp_queues)
+
+async def handle_sequence1(websocket):
+    while not websocket.close_rcvd:
+        # gather fans exceptions out properly: if one pattern dies,
+        # its siblings are not left burning behind a pending await.
+        await asyncio.gather(
+            *(ignition_timer(websocket, *spec) for spec in SEQ1_SPEC))
+
+async def handle_sequence2(websocket):
+    await run_schedule(websocket, SEQ2_EVENTS, SEQ2_CYCLE_NS, SEQ2_MASK)
+
+async def handle_sequence3(websocket):
+    while not websocket.close_rcvd:
+        await asyncio.gather(
+            *(ignition_timer(websocket, *spec) for spec in SEQ3_SPEC))
 
+async def handle_pattern(websocket, pattern):
+    pattern_engine.request_play(pattern)
     try:
-        # Continuously listen for messages from the client (if necessary)
         async for message in websocket:
-                pass
+            pass
     except websockets.exceptions.ConnectionClosed:
         pass
     finally:
-        if endpoint == 'cputemp':
-            # Remove the client's WebSocket connection when it is closed
-            connected_clients.remove(websocket)
-        else:
-            print("stop the fire")
+        pattern_engine.stop()
 
+async def handle_estop(websocket):
+    # Kill everything for as long as this connection is held open.
+    log.warning("EMERGENCY STOP engaged")
+    estop()
+    try:
+        async for message in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        clear_estop()
+
+async def handle_all(websocket):
+    log.warning("firing all stalks")
+    with FireGuard(ALL_MASK):
+        async for message in websocket:
+            await websocket.send(message)
+    log.warning("stopping fire on all stalks!")
 
+async def handle_stalk(websocket, name, mask):
+    log.warning("firing stalk %s", name)
+    with FireGuard(mask):
+        async for message in websocket:
+            await websocket.send(message)
+    log.warning("stopping fire on stalk %s", name)
+
+# Endpoint name -> handler, built once: dispatch is a single dict
+# lookup instead of an if/elif chain that rebuilt stalks.keys() on
+# every connection.
+DISPATCH = {
+    'cputemp': handle_cputemp,
+    'status': handle_status,
+    'sequence1': handle_sequence1,
+    'sequence2': handle_sequence2,
+    'sequence3': handle_sequence3,
+    'all': handle_all,
+    'estop': handle_estop,
+    'sweep': functools.partial(handle_pattern, pattern=SWEEP),
+}
+for _name, _flame in stalks.items():
+    DISPATCH[_name] = functools.partial(
+        handle_stalk, name=_name, mask=flames_to_mask([_flame]))
+
+async def handle_client(websocket):
+    log.warning("%s", websocket.path)
+    # rpartition is one C call with no list allocation, unlike
+    # split('/')[2]
+    endpoint = websocket.path.rpartition('/')[2]
+    handler = DISPATCH.get(endpoint)
+    if handler is not None:
+        await handler(websocket)
+        return
+    try:
+        # Unknown endpoint; just drain the client until it leaves
+        async for message in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
 
-if __name__ == "__main__":
-    # Set to store connected WebSocket clients
-    connected_clients = set()
-    start_server = websockets.serve(handle_client, "0.0.0.0", 8765)
-    asyncio.get_event_loop().run_until_complete(asyncio.gather(start_server, get_cpu_temp()))
-    asyncio.get_event_loop().run_forever()
-
-    exit(0)
-    for valve in valves:
-        if valve == None:
-            continue
-        print(valve)
-        valve.on()
-        sleep(0.250)
-        valve.off()
 
-# for valve in valves:
-#     if valve == None:
-#         continue
-#     for i in range(0,1):
-#         valve.on()
-#         sleep(0.066)
-#         valve.off()
-#         sleep(0.250)
 
+async def safety_monitor():
+    # Backstop behind the per-mask watchdogs. The whole check is two
+    # int loads a second -- no device reads, no locks: if valves have
+    # sat commanded-on with no write for longer than any watchdog
+    # would allow, something lost its forced-off; slam the bank shut.
+    stuck_ns = MAX_FIRE_NS + 2_000_000_000
+    while True:
+        await asyncio.sleep(1)
+        if current_mask and time.monotonic_ns() - last_write_ns > stuck_ns:
+            log.error("safety monitor: valves stuck on, forcing all off")
+            allFireOff()
+
+HTML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'html')
+
+async def serve_static():
+    # Control page on :8766, served from the same asyncio loop. aiohttp
+    # sends files with sendfile(2) -- no reader thread, no GIL handoff
+    # between asset fetches and the websocket side.
+    async def index(request):
+        return web.FileResponse(os.path.join(HTML_DIR, 'index.html'))
+
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_static('/', HTML_DIR, follow_symlinks=False)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', 8766).start()
+    return runner
+
+async def main():
+    if web is not None:
+        await serve_static()
+    else:
+        log.warning("aiohttp unavailable, not serving the control page")
+    # compression=None: per-message-deflate costs real CPU on the Pi's
+    # ARM cores and our messages are tiny control strings. max_size
+    # caps per-connection buffering for the same reason.
+    async with serve(handle_client, "0.0.0.0", 8765,
+                     compression=None, max_size=1024,
+                     ping_interval=20, ping_timeout=10):
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(get_cpu_temp())
+            tg.create_task(status_broadcast())
+            tg.create_task(safety_monitor())
 
 
+if __name__ == "__main__":
+    if uvloop is not None:
+        # libuv's timer heap is a lot cheaper and more accurate than
+        # the stock selector loop's -- worth having on the Pi.
+        uvloop.install()
+    asyncio.run(main())
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import datetime
-import os
+import socket
 from time import sleep
 import netifaces
 from gpiozero import Button, LED, DigitalOutputDevice, CPUTemperature
@@ -11,20 +11,23 @@ wifi_led = LED(11)
 burninator_led = LED(26)
 
 def check_axo_wifi():
-  interfaces = netifaces.interfaces()
-  addrs = netifaces.ifaddresses('wlan0')
-  for addr in addrs.values():
-    if addr[0]['addr'] == '10.0.1.2':
-      return True
+  # Look up wlan0's IPv4 address directly instead of walking every
+  # address family.
+  addrs = netifaces.ifaddresses('wlan0').get(netifaces.AF_INET)
+  if addrs and addrs[0].get('addr') == '10.0.1.2':
+    return True
   return None
 
 
 def check_burninator():
-    result = os.system("/bin/netstat -na | /bin/grep 8765 | /bin/grep -q LISTEN ")
-    if result == 0:
-        return True
-    else:
-        return None
+    # Probe the burninator port directly rather than forking
+    # netstat|grep|grep every 5 seconds; three forks on the Pi cost
+    # tens of ms and break if netstat isn't installed.
+    with socket.socket() as s:
+        s.settimeout(1)
+        if s.connect_ex(('127.0.0.1', 8765)) == 0:
+            return True
+    return None
 
 while True:
     if check_axo_wifi():
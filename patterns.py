@@ -0,0 +1,322 @@
+# Tick-based fire patterns for the burninator.
+#
+# A Pattern is a grid of FireEvents on a BPM-derived tick clock
+# (tick_resolution ticks per beat). PatternEngine plays one by handing
+# mask bursts to the edge scheduler in burninate.py, pacing itself with
+# absolute monotonic deadlines the same way the sequences do.
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+log = logging.getLogger('burninate.patterns')
+
+
+if njit is not None:
+    # Single compiled pass over ticks[:n]; the numpy fallback below is
+    # two passes (boolean mask, then flatnonzero) plus interpreter
+    # dispatch per call.
+    @njit(cache=True)
+    def _events_at_tick(ticks, n, tick):
+        count = 0
+        for i in range(n):
+            if ticks[i] == tick:
+                count += 1
+        out = np.empty(count, np.int32)
+        j = 0
+        for i in range(n):
+            if ticks[i] == tick:
+                out[j] = i
+                j += 1
+        return out
+
+    # warm the compile at import time, not on the first live query
+    _events_at_tick(np.zeros(1, np.int32), 0, 0)
+else:
+    def _events_at_tick(ticks, n, tick):
+        return np.flatnonzero(ticks[:n] == tick)
+
+
+@dataclass
+class FireEvent:
+    poofer_id: int
+    tick: int
+    duration: float  # seconds
+    velocity: float = 1.0  # scales duration, 0..1
+
+
+class Pattern:
+    # Events live in four parallel numpy arrays (struct-of-arrays)
+    # rather than a list of FireEvent objects: a big pattern is four
+    # contiguous buffers instead of thousands of ~56-byte pyobjects,
+    # and tick queries become one vectorized compare over ticks[:n].
+    # FireEvent survives as the unit callers add and get back --
+    # views are materialized from the arrays on demand.
+
+    def __init__(self, name, bpm=120.0, tick_resolution=4, loop=True,
+                 events=None):
+        self.name = name
+        self.bpm = bpm
+        self.tick_resolution = tick_resolution  # ticks per beat
+        self.loop = loop
+        self._n = 0
+        self._length = 0
+        # memoized set views, invalidated by the mutators below
+        self._active_cache = None
+        self._ticks_cache = None
+        cap = max(16, len(events) if events else 0)
+        self._pids = np.empty(cap, np.int8)
+        self._ticks = np.empty(cap, np.int32)
+        self._dur = np.empty(cap, np.float32)
+        self._vel = np.empty(cap, np.float32)
+        for event in events or ():
+            self.add_event(event)
+
+    def add_event(self, event):
+        n = self._n
+        if n == len(self._pids):
+            # amortized doubling, same policy as list.append; floored
+            # so exact-fit buffers (clone, from_columns) can grow from
+            # empty
+            for attr in ('_pids', '_ticks', '_dur', '_vel'):
+                arr = getattr(self, attr)
+                grown = np.empty(max(16, len(arr) * 2), arr.dtype)
+                grown[:n] = arr
+                setattr(self, attr, grown)
+        self._pids[n] = event.poofer_id
+        self._ticks[n] = event.tick
+        self._dur[n] = event.duration
+        self._vel[n] = event.velocity
+        self._n = n + 1
+        if event.tick >= self._length:
+            self._length = event.tick + 1
+        self._active_cache = None
+        self._ticks_cache = None
+
+    def remove_event(self, poofer_id, tick):
+        n = self._n
+        hits = np.flatnonzero((self._pids[:n] == poofer_id)
+                              & (self._ticks[:n] == tick))
+        if not len(hits):
+            return None
+        i = hits[0]
+        event = self._event_at(i)
+        # order doesn't matter, so swap the tail slot in
+        last = n - 1
+        for arr in (self._pids, self._ticks, self._dur, self._vel):
+            arr[i] = arr[last]
+        self._n = last
+        self._active_cache = None
+        self._ticks_cache = None
+        if tick == self._length - 1:
+            # only the removal of a final-tick event can shrink the length
+            self._length = (int(self._ticks[:last].max()) + 1) if last else 0
+        return event
+
+    def _event_at(self, i):
+        return FireEvent(int(self._pids[i]), int(self._ticks[i]),
+                         float(self._dur[i]), float(self._vel[i]))
+
+    def get_events_at_tick(self, tick):
+        hits = _events_at_tick(self._ticks, self._n, tick)
+        return [self._event_at(i) for i in hits]
+
+    def get_active_poofers(self):
+        if self._active_cache is None:
+            self._active_cache = set(np.unique(self._pids[:self._n]).tolist())
+        return self._active_cache
+
+    def get_ticks_with_events(self):
+        if self._ticks_cache is None:
+            self._ticks_cache = set(np.unique(self._ticks[:self._n]).tolist())
+        return self._ticks_cache
+
+    def clone(self, name=None):
+        # Four contiguous buffer copies -- no per-event FireEvent
+        # round trip. Caches start cold on the copy.
+        cloned = Pattern(name or self.name, self.bpm,
+                         self.tick_resolution, self.loop)
+        for attr in ('_pids', '_ticks', '_dur', '_vel'):
+            setattr(cloned, attr, getattr(self, attr)[:self._n].copy())
+        cloned._n = self._n
+        cloned._length = self._length
+        return cloned
+
+    def to_columns(self):
+        # Columnar wire form: one array per field rather than a dict
+        # per event, so there's no key repetition and no per-event
+        # allocation. The values are live numpy views --
+        # orjson.dumps(cols, option=orjson.OPT_SERIALIZE_NUMPY) dumps
+        # them directly; call .tolist() on them for stdlib json.
+        n = self._n
+        return {
+            'name': self.name,
+            'bpm': self.bpm,
+            'tick_resolution': self.tick_resolution,
+            'loop': self.loop,
+            'poofer_ids': self._pids[:n],
+            'ticks': self._ticks[:n],
+            'durations': self._dur[:n],
+            'velocities': self._vel[:n],
+        }
+
+    @classmethod
+    def from_columns(cls, cols):
+        pattern = cls(cols['name'], cols.get('bpm', 120.0),
+                      cols.get('tick_resolution', 4),
+                      cols.get('loop', True))
+        # One bulk conversion per field, not one add_event per event.
+        # np.array (not asarray) so the pattern owns its buffers even
+        # when handed the live views to_columns returns; add_event's
+        # growth floor handles the exact-fit (possibly zero) capacity.
+        pattern._pids = np.array(cols['poofer_ids'], np.int8)
+        pattern._ticks = np.array(cols['ticks'], np.int32)
+        pattern._dur = np.array(cols['durations'], np.float32)
+        pattern._vel = np.array(cols['velocities'], np.float32)
+        pattern._n = len(pattern._pids)
+        if pattern._n:
+            pattern._length = int(pattern._ticks.max()) + 1
+        return pattern
+
+    @property
+    def events(self):
+        return [self._event_at(i) for i in range(self._n)]
+
+    @property
+    def length_ticks(self):
+        return self._length
+
+
+class PatternEngine:
+    # Plays one pattern at a time. fire(at_ns, mask, duration_ns)
+    # schedules a burst; off(mask) forces valves closed on the way out.
+
+    def __init__(self, fire, off):
+        self._fire = fire
+        self._off = off
+        self._pattern = None
+        self._plan = ()
+        self._involved = 0
+        self._stop_event = asyncio.Event()
+        # Long-lived playback worker, started on first use: play
+        # requests just hand a pattern over and set an event, so
+        # repeated start/stop from the console doesn't allocate and
+        # cancel a Task (and unwind a CancelledError) every time.
+        self._play_request = asyncio.Event()
+        self._queued_pattern = None
+        self._worker = None
+
+    def load_pattern(self, pattern):
+        # Specialize the pattern into its playback plan once, up front,
+        # so the tick loop never scans the event list or does tick
+        # math: the plan holds only ticks that actually fire, keyed by
+        # their ready-made ns offset into the cycle (bpm and
+        # tick_resolution are baked in here), each with its
+        # (mask, duration_ns) bursts -- durations pre-scaled by
+        # velocity and same-duration events merged into one mask.
+        # Empty ticks cost nothing at play time. Edit the pattern or
+        # its bpm and load_pattern rebuilds the plan.
+        tick_ns = int(60e9 / (pattern.bpm * pattern.tick_resolution))
+        by_tick = {}
+        involved = 0
+        for event in pattern.events:
+            duration_ns = int(event.duration * event.velocity * 1e9)
+            mask = 1 << (event.poofer_id - 1)
+            involved |= mask
+            bursts = by_tick.setdefault(event.tick, {})
+            bursts[duration_ns] = bursts.get(duration_ns, 0) | mask
+        self._plan = tuple(
+            (tick, tick * tick_ns,
+             tuple((mask, duration_ns) for duration_ns, mask in bursts.items()))
+            for tick, bursts in sorted(by_tick.items())
+        )
+        self._tick_ns = tick_ns
+        self._cycle_ns = pattern.length_ticks * tick_ns
+        self._involved = involved
+        self._pattern = pattern
+
+    async def play(self, pattern):
+        if pattern is not self._pattern:
+            self.load_pattern(pattern)
+        if not self._plan or not self._cycle_ns:
+            # Nothing to fire; without this a looping empty pattern
+            # would spin the while loop below with no await and starve
+            # the event loop.
+            log.warning("pattern %s has no events, not playing",
+                        pattern.name)
+            return
+        tick_ns = self._tick_ns
+        cycle_ns = self._cycle_ns
+        # Local bindings for everything the tick loop touches; global
+        # and attribute lookups per tick add up at high BPM.
+        fire = self._fire
+        plan = self._plan
+        stopped = self._stop_event
+        is_stopped = stopped.is_set
+        stop_wait = stopped.wait
+        monotonic_ns = time.monotonic_ns
+        wait_for = asyncio.wait_for
+        stopped.clear()
+        base = monotonic_ns()
+        try:
+            while not is_stopped():
+                for tick, offset_ns, bursts in plan:
+                    target = base + offset_ns
+                    now = monotonic_ns()
+                    if now > target + tick_ns:
+                        # More than a whole tick late (loop stall, GC,
+                        # wifi hiccup): drop the burst instead of
+                        # smearing the rest of the pattern later.
+                        log.debug("dropping tick %d, %dus late",
+                                  tick, (now - target) // 1000)
+                        continue
+                    if now < target:
+                        # Sleep on the stop event so stop() wakes us
+                        # immediately instead of waiting out the gap to
+                        # the next burst.
+                        try:
+                            await wait_for(stop_wait(), (target - now) / 1e9)
+                        except asyncio.TimeoutError:
+                            pass
+                    if is_stopped():
+                        return
+                    for mask, duration_ns in bursts:
+                        fire(target, mask, duration_ns)
+                if not pattern.loop:
+                    break
+                # re-base on the nominal cycle length so loops don't drift
+                base += cycle_ns
+        finally:
+            self._off(self._involved)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def request_play(self, pattern):
+        # Queue a pattern for the worker, preempting whatever is
+        # playing. Must be called from the event loop thread.
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._playback_worker())
+        self._queued_pattern = pattern
+        self._stop_event.set()
+        self._play_request.set()
+
+    async def _playback_worker(self):
+        while True:
+            await self._play_request.wait()
+            self._play_request.clear()
+            pattern = self._queued_pattern
+            if pattern is None:
+                continue
+            try:
+                await self.play(pattern)
+            except Exception:
+                log.exception("pattern %s playback failed", pattern.name)